@@ -31,14 +31,17 @@
 from __future__ import annotations
 
 import argparse
+import array
 import binascii
-import configparser
 import hashlib
+import io
+import mmap
 import os
 import struct
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import List, Tuple, Dict, Optional, Set
+from typing import Iterator, List, NamedTuple, Tuple, Dict, Optional, Set, TextIO, Union
 
 FDT_MAGIC = 0xD00DFEED
 
@@ -49,10 +52,13 @@ FDT_NOP = 0x4
 FDT_END = 0x9
 
 U32 = struct.Struct(">I")
+# 结构块整体解码用的 4 字节无符号数组类型 ("I" 在主流平台上即为 4 字节)
+U32_ARRAY_TYPE = "I" if array.array("I").itemsize == 4 else "L"
+FDT_HEADER = struct.Struct(">10I")
+FDT_MAGIC_BYTES = U32.pack(FDT_MAGIC)
 
 
-@dataclass
-class DtbHeader:
+class DtbHeader(NamedTuple):
     magic: int
     totalsize: int
     off_dt_struct: int
@@ -66,48 +72,158 @@ class DtbHeader:
 
     @classmethod
     def parse(cls, data: bytes, off: int) -> Optional["DtbHeader"]:
-        if off + 40 > len(data):
+        if off + FDT_HEADER.size > len(data):
             return None
-        fields = struct.unpack_from(">10I", data, off)
+        fields = FDT_HEADER.unpack_from(data, off)
         if fields[0] != FDT_MAGIC:
             return None
         return cls(*fields)
 
 
-@dataclass
-class PropertyRef:
+class PropertyRef(NamedTuple):
     node_path: str
     name: str
     value_offset: int
     value_len: int
 
 
+class PropertyTable:
+    """一个 DTB 全部属性的列式存储 (structure of arrays)。
+
+    解析时每个属性只追加到四个并行数组，不再逐个创建 PropertyRef；
+    只有真正被查找到的属性才通过 ref(i) 生成 PropertyRef。
+    """
+
+    def __init__(self) -> None:
+        self.node_paths: List[str] = []
+        self.names: List[str] = []
+        self.value_offsets = array.array("L")
+        self.value_lens = array.array("L")
+        # 父节点路径 -> 直接子节点路径 (按出现顺序)，供按树结构定位节点
+        self.children: Dict[str, List[str]] = {}
+        self._index: Optional[Dict[Tuple[str, str], int]] = None
+
+    def append(self, node_path: str, name: str, value_offset: int, value_len: int) -> None:
+        self.node_paths.append(node_path)
+        self.names.append(name)
+        self.value_offsets.append(value_offset)
+        self.value_lens.append(value_len)
+
+    def ref(self, i: int) -> PropertyRef:
+        return PropertyRef(
+            self.node_paths[i], self.names[i], self.value_offsets[i], self.value_lens[i]
+        )
+
+    def lookup(self, node_path: str, name: str) -> Optional[PropertyRef]:
+        """按 (节点路径, 属性名) 查找属性；索引在首次查找时建立并缓存。"""
+        if self._index is None:
+            self._index = {key: i for i, key in enumerate(zip(self.node_paths, self.names))}
+        i = self._index.get((node_path, name))
+        return None if i is None else self.ref(i)
+
+
+def map_firmware(f) -> Union[mmap.mmap, bytes]:
+    """以只读方式映射固件文件，避免把整个镜像读入内存。
+
+    扫描 / 列表只需读取；打补丁时各机型只在共享映射之上的 PatchedView 中
+    记录修改，不复制固件。
+    空文件或不支持 mmap 的文件（如管道）退回到一次性读取。
+    """
+    try:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, OSError):
+        return f.read()
+
+
 def align4(x: int) -> int:
+    """向上对齐到 4 字节；FDT 遍历循环中直接内联为 (x + 3) & ~3 以省去函数调用。"""
     return (x + 3) & ~3
 
 
-def scan_dtbs(blob: bytes) -> List[Tuple[int, DtbHeader]]:
-    hits: List[Tuple[int, DtbHeader]] = []
-    magic_bytes = struct.pack(">I", FDT_MAGIC)
+def iter_dtbs(blob: bytes) -> Iterator[Tuple[int, DtbHeader]]:
+    """按偏移顺序逐个产出 (offset, header)，调用方可边扫描边处理或提前停止。"""
+    blob_len = len(blob)
     start = 0
     while True:
-        idx = blob.find(magic_bytes, start)
+        idx = blob.find(FDT_MAGIC_BYTES, start)
         if idx < 0:
             break
-        hdr = DtbHeader.parse(blob, idx)
-        if hdr and idx + hdr.totalsize <= len(blob):
-            hits.append((idx, hdr))
         start = idx + 4
-    return hits
+        # 先只读 totalsize 做越界检查，压缩数据里的伪 magic 大多在这里被排除，
+        # 不必解析完整头部、构造 DtbHeader
+        if idx + FDT_HEADER.size > blob_len:
+            continue
+        (totalsize,) = U32.unpack_from(blob, idx + 4)
+        if idx + totalsize > blob_len:
+            continue
+        hdr = DtbHeader.parse(blob, idx)
+        if hdr:
+            yield idx, hdr
+
+
+def scan_dtbs(blob: bytes) -> List[Tuple[int, DtbHeader]]:
+    return list(iter_dtbs(blob))
+
+
+def child_path(path_stack: List[str], name: str) -> str:
+    """由父节点路径 (path_stack 栈顶) 与节点名得到子节点完整路径。
+
+    每个节点只拼接一次字符串，属性直接复用栈顶路径；
+    空名 (根节点) 或 "/" 不产生新的路径层级。
+    """
+    parent = path_stack[-1] if path_stack else "/"
+    if not name or name == "/":
+        return parent
+    return "/" + name if parent == "/" else parent + "/" + name
+
 
+def dtb_struct_end(fw: bytes, base: int, hdr: DtbHeader) -> int:
+    """返回结构块遍历的上界：不越过本 DTB 的 totalsize，也不越过数据末尾。
 
-def parse_properties(fw: bytes, base: int, hdr: DtbHeader) -> List[PropertyRef]:
-    props: List[PropertyRef] = []
+    误命中 magic 的伪 DTB 往往没有 FDT_END，不加上界会一路扫到固件结尾。
+    """
+    return min(base + hdr.totalsize, len(fw))
+
+
+def load_struct_words(fw: bytes, struct_off: int, dtb_end: int) -> array.array:
+    """把结构块一次性解码为 u32 数组 (大端 -> 本机字节序)。
+
+    遍历时按下标取 token / 长度 / 名字偏移，不再为每个 token 调用 unpack_from。
+    下标 i 对应的绝对偏移为 struct_off + 4 * i。
+    """
+    words = array.array(U32_ARRAY_TYPE)
+    if struct_off < dtb_end:
+        words.frombytes(fw[struct_off : struct_off + ((dtb_end - struct_off) & ~3)])
+        if sys.byteorder == "little":
+            words.byteswap()
+    return words
+
+
+def parse_dtb(fw: bytes, base: int, hdr: DtbHeader) -> PropertyTable:
+    """一次遍历结构块，得到全部属性及节点的父子关系。"""
+    props = PropertyTable()
     struct_off = base + hdr.off_dt_struct
     strings_off = base + hdr.off_dt_strings
     strings_end = strings_off + hdr.size_dt_strings
-    cursor = struct_off
-    path_stack: List[str] = []
+    dtb_end = dtb_struct_end(fw, base, hdr)
+    words = load_struct_words(fw, struct_off, dtb_end)
+    n_words = len(words)
+    i = 0
+    path_stack: List[str] = []  # 每层保存该层节点的完整路径
+    # 属性名偏移 -> 属性名；strings 块在遇到第一个属性时才整块解码
+    name_cache: Dict[int, str] = {}
+    strings_decoded = False
+
+    def decode_strings() -> None:
+        """strings 块很小且属性名高度重复 (compatible/reg/status...)：整块切分、
+        一次性解码；末尾未以 NUL 结束的残片不收录。
+
+        size_dt_strings 来自头部，伪 magic 命中时可能是任意值，切片不超出 DTB 自身范围。
+        """
+        pos = 0
+        for chunk in fw[strings_off : min(strings_end, dtb_end)].split(b"\x00")[:-1]:
+            name_cache[pos] = chunk.decode(errors="replace")
+            pos += len(chunk) + 1
 
     def read_cstring(o: int) -> str:
         end = fw.find(b"\x00", o, strings_end)
@@ -115,33 +231,54 @@ def parse_properties(fw: bytes, base: int, hdr: DtbHeader) -> List[PropertyRef]:
             return "?"
         return fw[o:end].decode(errors="replace")
 
-    while cursor < len(fw):
-        (token,) = U32.unpack_from(fw, cursor)
-        cursor += 4
-        if token == FDT_BEGIN_NODE:
-            end = fw.find(b"\x00", cursor)
+    # 循环内频繁使用的全局常量与绑定方法先取到局部变量，省去每个 token 的全局/属性查找
+    BEGIN_NODE, END_NODE, PROP, NOP, END = (
+        FDT_BEGIN_NODE, FDT_END_NODE, FDT_PROP, FDT_NOP, FDT_END
+    )
+    find = fw.find
+    add_prop = props.append
+    cached_name = name_cache.get
+    children = props.children
+
+    while i < n_words:
+        token = words[i]
+        i += 1
+        # 分支按出现频率排列：属性最多，其次是节点开始/结束
+        if token == PROP:
+            if i + 2 > n_words:
+                break
+            val_len = words[i]
+            name_off = words[i + 1]
+            value_off = struct_off + 4 * (i + 2)
+            i += 2 + ((val_len + 3) >> 2)
+            name = cached_name(name_off)
+            if name is None and not strings_decoded:
+                strings_decoded = True
+                decode_strings()
+                name = cached_name(name_off)
+            if name is None:
+                # dtc 会合并公共后缀 (如 "phandle" 指向 "linux,phandle" 中间)，
+                # 这类偏移不在预解码表中，按需读取后补入
+                name = name_cache[name_off] = read_cstring(strings_off + name_off)
+            node_path = path_stack[-1] if path_stack else "/"
+            add_prop(node_path, name, value_off, val_len)
+        elif token == BEGIN_NODE:
+            name_start = struct_off + 4 * i
+            end = find(b"\x00", name_start, dtb_end)
             if end == -1:
                 break
-            name = fw[cursor:end].decode(errors="replace")
-            cursor = align4(end + 1)
-            path_stack.append(name if name else "/")
-        elif token == FDT_END_NODE:
+            name = fw[name_start:end].decode(errors="replace")
+            i = (end - struct_off + 4) >> 2  # align4(end + 1)，相对结构块
+            node_path = child_path(path_stack, name)
+            if path_stack:
+                children.setdefault(path_stack[-1], []).append(node_path)
+            path_stack.append(node_path)
+        elif token == END_NODE:
             if path_stack:
                 path_stack.pop()
-        elif token == FDT_PROP:
-            if cursor + 8 > len(fw):
-                break
-            (val_len,) = U32.unpack_from(fw, cursor)
-            (name_off,) = U32.unpack_from(fw, cursor + 4)
-            cursor += 8
-            value_off = cursor
-            cursor = align4(cursor + val_len)
-            name = read_cstring(strings_off + name_off)
-            node_path = "/" + "/".join([p for p in path_stack if p and p != "/"])
-            props.append(PropertyRef(node_path, name, value_off, val_len))
-        elif token == FDT_NOP:
+        elif token == NOP:
             continue
-        elif token == FDT_END:
+        elif token == END:
             break
         else:
             break
@@ -157,92 +294,113 @@ def read_c_string_from_value(blob: bytes, prop: PropertyRef) -> str:
     return raw.split(b"\x00", 1)[0].decode(errors="replace")
 
 
-def collect_node_paths(fw: bytes, base: int, hdr: DtbHeader) -> Set[str]:
-    """收集 DTB 结构块中的所有节点路径 (包含没有属性的节点)。"""
+FIT_TOP_NODES = frozenset(("images", "configurations"))
+
+
+def is_fit_dtb(fw: bytes, base: int, hdr: DtbHeader) -> bool:
+    """判断 DTB 根节点下是否同时存在 images 与 configurations 子节点。
+
+    只处理 FDT_BEGIN_NODE，属性值直接跳过；两个节点都出现后立即返回，
+    不必像 parse_dtb 那样走完整个结构块。
+    """
+    dtb_end = dtb_struct_end(fw, base, hdr)
     struct_off = base + hdr.off_dt_struct
     cursor = struct_off
-    path_stack: List[str] = []
-    paths: Set[str] = set()
-    while cursor < len(fw):
-        try:
-            (token,) = U32.unpack_from(fw, cursor)
-        except struct.error:
-            break
+    depth = 0
+    seen: Set[str] = set()
+    # 与 parse_dtb 相同：循环内用到的全局常量与方法先绑定为局部变量
+    BEGIN_NODE, END_NODE, PROP, NOP = FDT_BEGIN_NODE, FDT_END_NODE, FDT_PROP, FDT_NOP
+    find = fw.find
+    unpack_u32 = U32.unpack_from
+    while cursor + 4 <= dtb_end:
+        (token,) = unpack_u32(fw, cursor)
         cursor += 4
-        if token == FDT_BEGIN_NODE:
-            end = fw.find(b"\x00", cursor)
-            if end == -1:
+        if token == PROP:
+            if cursor + 8 > dtb_end:
                 break
-            name = fw[cursor:end].decode(errors="replace")
-            cursor = align4(end + 1)
-            path_stack.append(name if name else "/")
-            node_path = "/" + "/".join([p for p in path_stack if p and p != "/"])
-            paths.add(node_path if node_path != "" else "/")
-        elif token == FDT_END_NODE:
-            if path_stack:
-                path_stack.pop()
-        elif token == FDT_PROP:
-            if cursor + 8 > len(fw):
+            (val_len,) = unpack_u32(fw, cursor)
+            # 与 parse_dtb 一致，按相对结构块起点对齐 (DTB 本身未必 4 字节对齐)
+            cursor = struct_off + ((cursor - struct_off + val_len + 11) & ~3)
+        elif token == BEGIN_NODE:
+            end = find(b"\x00", cursor, dtb_end)
+            if end == -1:
                 break
-            (val_len,) = U32.unpack_from(fw, cursor)
-            cursor += 8
-            cursor = align4(cursor + val_len)
-        elif token == FDT_NOP:
+            depth += 1
+            if depth == 2:
+                name = fw[cursor:end].decode(errors="replace")
+                if name in FIT_TOP_NODES:
+                    seen.add(name)
+                    if len(seen) == len(FIT_TOP_NODES):
+                        return True
+            cursor = struct_off + ((end - struct_off + 4) & ~3)
+        elif token == END_NODE:
+            if depth:
+                depth -= 1
+        elif token == NOP:
             continue
-        elif token == FDT_END:
-            break
         else:
             break
-    return paths
+    return False
+
 
+def detect_fit(
+    dtbs: List[Tuple[int, DtbHeader]],
+    data: bytes,
+    dtb_props: Optional[List[PropertyTable]] = None,
+) -> Optional[Tuple[int, DtbHeader, PropertyTable]]:
+    """检测外层 FIT DTB (包含 '/images' 与 '/configurations' 节点)。
 
-def detect_fit(dtbs: List[Tuple[int, DtbHeader]], data: bytes) -> Optional[Tuple[int, DtbHeader, List[PropertyRef]]]:
-    """检测外层 FIT DTB (包含 '/images' 与 '/configurations' 节点)。"""
-    for off, hdr in dtbs:
-        node_paths = collect_node_paths(data, off, hdr)
-        if "/images" in node_paths and "/configurations" in node_paths:
-            props = parse_properties(data, off, hdr)
+    若提供 dtb_props (与 dtbs 一一对应的已解析属性)，则直接复用，不再重新解析。
+    """
+    for i, (off, hdr) in enumerate(dtbs):
+        if is_fit_dtb(data, off, hdr):
+            props = dtb_props[i] if dtb_props is not None else parse_dtb(data, off, hdr)
             return off, hdr, props
     return None
 
 
-def group_fit_image_hashes(props: List[PropertyRef], blob: bytes) -> Dict[str, Dict[str, PropertyRef]]:
-    """按 image 节点分组 hash 属性 (/images/<name>/hash-*).
+def group_fit_image_hashes(
+    props: PropertyTable, blob: bytes
+) -> List[Tuple[str, PropertyRef, PropertyRef]]:
+    """收集同时带 crc32 与 sha1 hash 的 image 节点 (/images/<name>/hash-*).
 
-    返回: image_node -> { 'crc32': PropertyRef, 'sha1': PropertyRef }
+    返回: [(image_node, crc32 值属性, sha1 值属性)]，按节点顺序；
+    FIT 中 image 一般不超过十几个，平铺列表线性查找即可。
     """
-    by_path: Dict[str, List[PropertyRef]] = {}
-    for p in props:
-        by_path.setdefault(p.node_path, []).append(p)
-
-    image_hashes: Dict[str, Dict[str, PropertyRef]] = {}
-    for p in props:
-        parts = p.node_path.strip("/").split("/")
-        if len(parts) < 3:
-            continue
-        if parts[0] != "images":
-            continue
-        if parts[-1].startswith("hash-"):
-            hash_node = p.node_path
-            image_node = "/" + "/".join(parts[:-1])
-            siblings = by_path.get(hash_node, [])
-            algo_prop = next((sp for sp in siblings if sp.name == "algo"), None)
-            value_prop = next((sp for sp in siblings if sp.name == "value"), None)
-            if not algo_prop or not value_prop:
+    images: List[Tuple[str, PropertyRef, PropertyRef]] = []
+    # 只沿 /images -> <image> -> hash-* 的子节点关系走，algo/value 各一次字典查找
+    for image_node in props.children.get("/images", ()):
+        algomap: Dict[str, PropertyRef] = {}
+        for hash_node in props.children.get(image_node, ()):
+            if not hash_node.rsplit("/", 1)[1].startswith("hash-"):
                 continue
-            algo = read_c_string_from_value(blob, algo_prop)
-            if algo not in ("crc32", "sha1"):
+            algo_prop = props.lookup(hash_node, "algo")
+            value_prop = props.lookup(hash_node, "value")
+            if algo_prop is None or value_prop is None:
                 continue
-            image_entry = image_hashes.setdefault(image_node, {})
-            image_entry[algo] = value_prop
-    return image_hashes
+            algo = read_c_string_from_value(blob, algo_prop)
+            if algo in ("crc32", "sha1"):
+                algomap[algo] = value_prop
+        if "crc32" in algomap and "sha1" in algomap:
+            images.append((image_node, algomap["crc32"], algomap["sha1"]))
+    return images
+
 
+def compute_crc32(data: Union[bytes, bytearray, memoryview]) -> int:
+    """IEEE CRC-32 (与 FIT hash 的 crc32 算法一致)。
 
-def compute_crc32(data: bytes) -> int:
+    binascii.crc32 在 CPython 中直接使用 zlib 的实现，与 zlib.crc32 同路径；
+    接受任意 buffer 对象 (bytes / bytearray / memoryview)，无需先复制。
+    """
     return binascii.crc32(data) & 0xFFFFFFFF
 
 
-def patch_gpios_triplet_second(data: bytearray, prop: PropertyRef, expect_second: Optional[int], new_second: int) -> bool:
+def compute_digests(data: Union[bytes, bytearray, memoryview]) -> Tuple[int, bytes]:
+    """一次性计算 FIT hash 节点需要的 (crc32, sha1 digest)。"""
+    return compute_crc32(data), hashlib.sha1(data).digest()
+
+
+def patch_gpios_triplet_second(data: "PatchedView", prop: PropertyRef, expect_second: Optional[int], new_second: int) -> bool:
     """针对 u32 triplet (3 * u32) 的 gpios 属性, 仅读/改第二个 u32。
     
     参数:
@@ -256,17 +414,75 @@ def patch_gpios_triplet_second(data: bytearray, prop: PropertyRef, expect_second
     """
     if prop.value_len != 12:
         return False
-    a, b, c = struct.unpack_from(">III", data, prop.value_offset)
+    # 首尾两个 cell 不参与判断也不改写，只读写中间 4 字节
+    mid_off = prop.value_offset + 4
+    (cur,) = U32.unpack(data[mid_off : mid_off + 4])
     # 如果指定了期望值，则验证当前值是否匹配
-    if expect_second is not None and b != expect_second:
+    if expect_second is not None and cur != expect_second:
         return False
     # 如果已经是目标值，无需修改
-    if b == new_second:
+    if cur == new_second:
         return False
-    struct.pack_into(">III", data, prop.value_offset, a, new_second, c)
+    data[mid_off : mid_off + 4] = U32.pack(new_second)
     return True
 
 
+class PatchedView:
+    """原始固件 + 少量等长覆盖写入的写时复制视图。
+
+    多个机型共享同一份只读原始数据 (mmap 或 bytes)，每个机型只记录
+    (偏移, 新字节) 修改列表；读切片时叠加修改，写出时分段流式输出，
+    不再为每个机型复制整份固件。
+    """
+
+    def __init__(self, base: Union[mmap.mmap, bytes]) -> None:
+        self.base = base
+        self.edits: List[Tuple[int, bytes]] = []  # 互不重叠
+
+    def __getitem__(self, key: slice) -> bytes:
+        start, stop, _ = key.indices(len(self.base))
+        return bytes(self.overlay(start, stop))
+
+    def is_edited(self, start: int, stop: int) -> bool:
+        """[start, stop) 区间内是否已有修改。"""
+        return any(off < stop and off + len(new) > start for off, new in self.edits)
+
+    def overlay(self, start: int, stop: int) -> bytearray:
+        """复制 [start, stop) 的原始数据并叠加修改。"""
+        out = bytearray(self.base[start:stop])
+        for off, new in self.edits:
+            lo = max(off, start)
+            hi = min(off + len(new), stop)
+            if lo < hi:
+                out[lo - start : hi - start] = new[lo - off : hi - off]
+        return out
+
+    def __setitem__(self, key: slice, value: bytes) -> None:
+        start, stop, _ = key.indices(len(self.base))
+        if stop - start != len(value):
+            raise ValueError("PatchedView only supports same-size overwrites")
+        # 与已有修改重叠时合并成一段，保证 edits 互不重叠
+        overlapping = [e for e in self.edits if e[0] < stop and e[0] + len(e[1]) > start]
+        if overlapping:
+            lo = min([start] + [off for off, _ in overlapping])
+            hi = max([stop] + [off + len(new) for off, new in overlapping])
+            merged = bytearray(self[lo:hi])
+            merged[start - lo : stop - lo] = value
+            self.edits = [e for e in self.edits if e not in overlapping]
+            start, value = lo, bytes(merged)
+        self.edits.append((start, bytes(value)))
+
+    def write_to(self, f) -> None:
+        """按偏移顺序写出：原始数据片段与修改片段交替写入。"""
+        prev = 0
+        with memoryview(self.base) as mv:
+            for off, new in sorted(self.edits):
+                f.write(mv[prev:off])
+                f.write(new)
+                prev = off + len(new)
+            f.write(mv[prev:])
+
+
 # ------------------------- 配置结构 -------------------------------------------
 
 @dataclass
@@ -290,20 +506,83 @@ class PatchConfig:
     targets: List[TargetConfig]
 
 
-def load_single_profile_config(cp: configparser.ConfigParser, profile: str) -> PatchConfig:
-    """从 ConfigParser 对象中加载单个 profile 的配置。
+INI_COMMENT_PREFIXES = ("#", ";")
+
+
+def strip_inline_comment(line: str) -> str:
+    """去掉行内注释：; 或 # 前面必须是空白才算注释 (与 configparser 相同)。"""
+    cut = len(line)
+    for prefix in INI_COMMENT_PREFIXES:
+        i = line.find(prefix)
+        while i > 0 and not line[i - 1].isspace():
+            i = line.find(prefix, i + 1)
+        if i > 0:
+            cut = min(cut, i)
+    return line[:cut].rstrip()
+
+
+def parse_ini(path: str) -> Dict[str, Dict[str, str]]:
+    """读取 INI 文件为 {section: {key: value}}。
+
+    轻量实现，替代 configparser 以减少启动开销，行为与原先的
+    ConfigParser(inline_comment_prefixes=(';', '#')) 保持一致:
+    - 以 ; 或 # 开头的行为注释；行内注释见 strip_inline_comment
+    - 支持 = 与 : 分隔，键名转为小写，键和值去除首尾空白
+    - [DEFAULT] 中的键作为其它 section 的默认值
+    - 重复的 section / 键、缺少 section 头、无法解析的行均抛出 ValueError
+    - 不支持续行：缩进的非注释行抛出 ValueError (configparser 会把它并入上一个值)
+    """
+    sections: Dict[str, Dict[str, str]] = {}
+    defaults: Dict[str, str] = {}
+    current: Optional[Dict[str, str]] = None
+    with open(path, "r", encoding="utf-8") as f:
+        for lineno, raw in enumerate(f, start=1):
+            line = raw.strip()
+            if not line or line.startswith(INI_COMMENT_PREFIXES):
+                continue
+            if raw[0].isspace():
+                # configparser 会把缩进行当作上一个值的续行，这里不支持，直接报错
+                raise ValueError(f"Indented line {lineno} is not supported: {raw.strip()!r}")
+            line = strip_inline_comment(line)
+            if line.startswith("[") and line.rfind("]") > 1:
+                name = line[1 : line.rfind("]")]
+                if name == "DEFAULT":
+                    current = defaults
+                elif name in sections:
+                    raise ValueError(f"Duplicate section '{name}' (line {lineno})")
+                else:
+                    current = sections[name] = {}
+                continue
+            if current is None:
+                raise ValueError(f"Missing section header before line {lineno}: {raw.strip()!r}")
+            seps = [i for i in (line.find("="), line.find(":")) if i >= 0]
+            key = line[: min(seps)].strip().lower() if seps else ""
+            if not key:
+                raise ValueError(f"Cannot parse line {lineno}: {raw.strip()!r}")
+            if key in current:
+                raise ValueError(f"Duplicate key '{key}' (line {lineno})")
+            current[key] = line[min(seps) + 1 :].strip()
+
+    for sect in sections.values():
+        for key, value in defaults.items():
+            sect.setdefault(key, value)
+    return sections
+
+
+def load_single_profile_config(sections: Dict[str, Dict[str, str]], profile: str) -> PatchConfig:
+    """从 parse_ini 的结果中加载单个 profile 的配置。
     
     参数:
-        cp: ConfigParser 对象
+        sections: parse_ini 返回的 {section: {key: value}}
         profile: profile 名称（section 名）
     
     返回:
         PatchConfig 对象
     """
-    if profile not in cp:
+    if profile not in sections:
         raise ValueError(f"Profile '{profile}' not found in INI config")
     
-    sect = cp[profile]
+    sect = sections[profile]
     
     # 解析 dtb_index
     dtb_index: Optional[int]
@@ -355,7 +634,7 @@ def load_ini_config(path: str, profile: Optional[str]) -> List[PatchConfig]:
     - dtb_index: 可选，整数。
     - 其它键: 视为 LED 名，值为目标值，例如 "8" 或 "0x8"。
     
-    注意: 使用 inline_comment_prefixes 以支持 INI 文件中的内联注释（如：green = 8 ; 注释 或 green = 8 # 注释）。
+    注意: 支持 INI 文件中的内联注释（如：green = 8 ; 注释 或 green = 8 # 注释），见 parse_ini。
     
     参数:
         path: INI 配置文件路径
@@ -364,19 +643,17 @@ def load_ini_config(path: str, profile: Optional[str]) -> List[PatchConfig]:
     返回:
         PatchConfig 对象列表
     """
-    cp = configparser.ConfigParser(inline_comment_prefixes=(';', '#'))
-    with open(path, "r", encoding="utf-8") as f:
-        cp.read_file(f)
+    sections = parse_ini(path)
 
-    if not cp.sections():
+    if not sections:
         raise ValueError("INI config has no sections")
 
     if profile is None:
         # 若未指定 profile，则加载所有 profiles
         configs = []
-        for section in cp.sections():
+        for section in sections:
             try:
-                cfg = load_single_profile_config(cp, section)
+                cfg = load_single_profile_config(sections, section)
                 configs.append(cfg)
             except ValueError as e:
                 print(f"Warning: Skipping invalid profile '{section}': {e}. Processing will continue with other profiles.", file=sys.stderr)
@@ -385,7 +662,7 @@ def load_ini_config(path: str, profile: Optional[str]) -> List[PatchConfig]:
         return configs
     else:
         # 若指定了 profile，则只加载该 profile
-        return [load_single_profile_config(cp, profile)]
+        return [load_single_profile_config(sections, profile)]
 
 
 # ------------------------- 主逻辑 ---------------------------------------------
@@ -393,21 +670,32 @@ def load_ini_config(path: str, profile: Optional[str]) -> List[PatchConfig]:
 
 def process_single_profile(
     cfg: PatchConfig, 
-    data: bytearray, 
+    data: PatchedView, 
     dtbs: List[Tuple[int, DtbHeader]], 
-    args: argparse.Namespace
+    dtb_props: List[PropertyTable],
+    dtb_node_sets: List[Set[str]],
+    fit: Optional[Tuple[int, DtbHeader, PropertyTable]],
+    args: argparse.Namespace,
+    out: Optional[TextIO] = None,
+    err: Optional[TextIO] = None,
 ) -> Tuple[int, List[str]]:
     """处理单个 profile，返回修改次数和摘要行列表。
     
     参数:
         cfg: PatchConfig 配置对象
-        data: 固件数据 (会被修改)
+        data: 固件数据视图 (修改记录在其中，原始数据不变)
         dtbs: DTB 列表
+        dtb_props: 每个 DTB 预先解析好的属性列表 (与 dtbs 一一对应)
+        dtb_node_sets: 每个 DTB 含属性的节点路径集合 (与 dtbs 一一对应)
+        fit: detect_fit 的结果 (外层 FIT DTB)，未检测到为 None
         args: 命令行参数
+        out / err: 日志输出流，默认 sys.stdout / sys.stderr
     
     返回:
         (total_changes, summary_lines)
     """
+    out = out or sys.stdout
+    err = err or sys.stderr
     total_changes = 0
     # (dtb_index, old_crc_be4, new_crc_be4, old_sha1, new_sha1)
     modified_dtbs_digests: List[Tuple[int, bytes, bytes, bytes, bytes]] = []
@@ -422,52 +710,51 @@ def process_single_profile(
         else:
             wanted_nodes = {m.node for m in t.mappings}
             cand_idx: Optional[int] = None
-            for i, (off_i, hdr_i) in enumerate(dtbs):
-                props_i = parse_properties(data, off_i, hdr_i)
-                node_paths_i = {p.node_path for p in props_i}
+            for i, node_paths_i in enumerate(dtb_node_sets):
                 if any(n in node_paths_i for n in wanted_nodes):
                     cand_idx = i
                     break
             if cand_idx is None:
                 print(
-                    f"Warning: no DTB contains any of nodes {wanted_nodes}, skip this target"
+                    f"Warning: no DTB contains any of nodes {wanted_nodes}, skip this target",
+                    file=out,
                 )
                 continue
             idx = cand_idx
 
         if idx < 0 or idx >= len(dtbs):
-            print(f"Warning: target dtb_index {idx} out of range, skip", file=sys.stderr)
+            print(f"Warning: target dtb_index {idx} out of range, skip", file=err)
             continue
 
         off, hdr = dtbs[idx]
-        props = parse_properties(data, off, hdr)
-        prop_map: Dict[Tuple[str, str], PropertyRef] = {
-            (p.node_path, p.name): p for p in props
-        }
+        props = dtb_props[idx]
 
         print(
             f"Applying profile '{cfg.profile}' to DTB {idx} "
-            f"(offset=0x{off:X}) with {len(t.mappings)} mapping(s)"
+            f"(offset=0x{off:X}) with {len(t.mappings)} mapping(s)",
+            file=out,
         )
 
-        original_slice = bytes(data[off : off + hdr.totalsize])
-        old_crc = compute_crc32(original_slice)
-        old_sha1 = hashlib.sha1(original_slice).digest()
+        # digest 等确认有修改后再计算。修改另存于 data.edits，原始数据不会被改写，
+        # 只有本区间此前已被修改时才需要先复制一份修改前的内容
+        dtb_end = off + hdr.totalsize
+        original_copy = data.overlay(off, dtb_end) if data.is_edited(off, dtb_end) else None
 
         local_changed = False
         for m in t.mappings:
-            key = (m.node, m.property)
-            ref = prop_map.get(key)
+            ref = props.lookup(m.node, m.property)
             if not ref:
                 print(
                     f"Warning: property {m.property} not found in node {m.node} "
-                    f"(DTB {idx})"
+                    f"(DTB {idx})",
+                    file=out,
                 )
                 continue
             if m.kind == "u32_triplet":
                 if m.second_to is None:
                     print(
-                        f"Warning: mapping for {m.node}:{m.property} missing second_to, skip"
+                        f"Warning: mapping for {m.node}:{m.property} missing second_to, skip",
+                        file=out,
                     )
                     continue
                 if patch_gpios_triplet_second(
@@ -476,12 +763,14 @@ def process_single_profile(
                     if m.second_from is not None:
                         print(
                             f"Patched {m.node}:{m.property} second cell "
-                            f"{m.second_from:#x}->{m.second_to:#x} (DTB {idx})"
+                            f"{m.second_from:#x}->{m.second_to:#x} (DTB {idx})",
+                            file=out,
                         )
                     else:
                         print(
                             f"Patched {m.node}:{m.property} second cell "
-                            f"->{m.second_to:#x} (DTB {idx})"
+                            f"->{m.second_to:#x} (DTB {idx})",
+                            file=out,
                         )
                     total_changes += 1
                     local_changed = True
@@ -489,69 +778,77 @@ def process_single_profile(
                     if m.second_from is not None:
                         print(
                             f"No change / mismatch for {m.node}:{m.property} "
-                            f"(expected second {m.second_from:#x})"
+                            f"(expected second {m.second_from:#x})",
+                            file=out,
                         )
                     else:
                         print(
                             f"No change for {m.node}:{m.property} "
-                            f"(already set to {m.second_to:#x})"
+                            f"(already set to {m.second_to:#x})",
+                            file=out,
                         )
             else:
                 print(
-                    f"Warning: unsupported mapping kind '{m.kind}' (node {m.node}), skip"
+                    f"Warning: unsupported mapping kind '{m.kind}' (node {m.node}), skip",
+                    file=out,
                 )
 
         if local_changed:
-            new_slice = bytes(data[off : off + hdr.totalsize])
-            if new_slice != original_slice:
-                new_crc = compute_crc32(new_slice)
-                new_sha1 = hashlib.sha1(new_slice).digest()
-                modified_dtbs_digests.append(
-                    (
-                        idx,
-                        struct.pack(">I", old_crc),
-                        struct.pack(">I", new_crc),
-                        old_sha1,
-                        new_sha1,
-                    )
-                )
-                line = (
-                    f"DTB {idx} digest update: crc32 {old_crc:08x}->{new_crc:08x}, "
-                    f"sha1 {old_sha1.hex()}->{new_sha1.hex()}"
+            # 补丁只在值确实改变时才返回 True，无需再整段比较新旧内容
+            if original_copy is None:
+                # 直接读取原始数据 (零复制)；with 保证视图及时释放，之后才能关闭 mmap
+                with memoryview(data.base)[off:dtb_end] as original_view:
+                    old_crc, old_sha1 = compute_digests(original_view)
+            else:
+                old_crc, old_sha1 = compute_digests(original_copy)
+            new_crc, new_sha1 = compute_digests(data.overlay(off, dtb_end))
+            modified_dtbs_digests.append(
+                (
+                    idx,
+                    U32.pack(old_crc),
+                    U32.pack(new_crc),
+                    old_sha1,
+                    new_sha1,
                 )
-                print(line)
-                summary_lines.append(line)
+            )
+            line = (
+                f"DTB {idx} digest update: crc32 {old_crc:08x}->{new_crc:08x}, "
+                f"sha1 {old_sha1.hex()}->{new_sha1.hex()}"
+            )
+            print(line, file=out)
+            summary_lines.append(line)
 
     # 更新 FIT hash
     if modified_dtbs_digests and not args.no_fit_hash:
-        fit = detect_fit(dtbs, data)
         if not fit:
             print(
-                "Warning: FIT image DTB not detected; cannot auto-update hash values (node detection failed)"
+                "Warning: FIT image DTB not detected; cannot auto-update hash values (node detection failed)",
+                file=out,
             )
         else:
             fit_off, fit_hdr, fit_props = fit
-            image_hash_map = group_fit_image_hashes(fit_props, data)
+            # 各 image 当前的 (crc32, sha1) 只读取一次
+            fit_images = [
+                (image_node, crc_prop, sha1_prop,
+                 read_prop_bytes(data, crc_prop), read_prop_bytes(data, sha1_prop))
+                for image_node, crc_prop, sha1_prop in group_fit_image_hashes(fit_props, data)
+            ]
             updated_images = 0
             for dtb_idx, old_crc_be, new_crc_be, old_sha1, new_sha1 in modified_dtbs_digests:
                 matched_image = None
-                for image_node, algomap in image_hash_map.items():
-                    crc_prop = algomap.get("crc32")
-                    sha1_prop = algomap.get("sha1")
-                    if not crc_prop or not sha1_prop:
-                        continue
-                    current_crc = read_prop_bytes(data, crc_prop)
-                    current_sha1 = read_prop_bytes(data, sha1_prop)
-                    if current_crc == old_crc_be and current_sha1 == old_sha1:
-                        matched_image = (image_node, crc_prop, sha1_prop)
+                for i, (_, _, _, cur_crc, cur_sha1) in enumerate(fit_images):
+                    if cur_crc == old_crc_be and cur_sha1 == old_sha1:
+                        # 取出后即移除，同一个 image 不会被两个 DTB 重复匹配
+                        matched_image = fit_images.pop(i)
                         break
                 if not matched_image:
                     print(
                         "Warning: Could not find matching FIT hash nodes for modified "
-                        "DTB (old digests not present)."
+                        "DTB (old digests not present).",
+                        file=out,
                     )
                     continue
-                image_node, crc_prop, sha1_prop = matched_image
+                image_node, crc_prop, sha1_prop, _, _ = matched_image
                 data[crc_prop.value_offset : crc_prop.value_offset + 4] = new_crc_be
                 data[sha1_prop.value_offset : sha1_prop.value_offset + 20] = new_sha1
                 updated_images += 1
@@ -559,18 +856,83 @@ def process_single_profile(
                     f"Updated FIT hashes for {image_node}: crc32 -> {new_crc_be.hex()} "
                     f"sha1 -> {new_sha1.hex()}"
                 )
-                print(msg)
+                print(msg, file=out)
                 summary_lines.append(msg)
             if updated_images == 0:
-                print("Warning: No FIT hashes updated (digest match not found).")
+                print("Warning: No FIT hashes updated (digest match not found).", file=out)
             else:
                 line = f"FIT hash update completed for {updated_images} image(s)"
-                print(line)
+                print(line, file=out)
                 summary_lines.append(line)
 
     return total_changes, summary_lines
 
 
+@dataclass
+class BoardResult:
+    profile: str
+    stdout: str
+    stderr: str
+    out_path: Optional[str] = None  # 成功写出的文件
+    skipped: bool = False  # 无任何修改，未生成文件
+
+
+def patch_board(
+    cfg: PatchConfig,
+    original_data: Union[mmap.mmap, bytes],
+    dtbs: List[Tuple[int, DtbHeader]],
+    dtb_props: List[PropertyTable],
+    dtb_node_sets: List[Set[str]],
+    fit: Optional[Tuple[int, DtbHeader, PropertyTable]],
+    args: argparse.Namespace,
+) -> BoardResult:
+    """为单个机型打补丁并写出固件；可在工作线程中运行，日志写入各自缓冲区。"""
+    out = io.StringIO()
+    err = io.StringIO()
+    result = BoardResult(cfg.profile, "", "")
+
+    print(f"\n{'='*60}", file=out)
+    print(f"Processing board: {cfg.profile}", file=out)
+    print(f"{'='*60}", file=out)
+
+    # 每个 profile 只记录自己的修改，原始数据在所有 profiles 间共享
+    data = PatchedView(original_data)
+
+    total_changes, summary_lines = process_single_profile(
+        cfg, data, dtbs, dtb_props, dtb_node_sets, fit, args, out, err
+    )
+
+    if total_changes == 0:
+        print(f"No changes applied for {cfg.profile} (all values already set to target values or properties not found)", file=out)
+        result.skipped = True
+    else:
+        # 输出文件名
+        if args.output:
+            out_path = args.output
+        else:
+            base_name = os.path.basename(args.firmware)
+            out_path = f"{cfg.profile}-{base_name}"
+
+        if os.path.abspath(out_path) == os.path.abspath(args.firmware):
+            print(f"Error: Refusing to overwrite input for {cfg.profile} (choose different -o)", file=err)
+        else:
+            try:
+                with open(out_path, "wb") as f:
+                    data.write_to(f)
+                print(f"Wrote patched firmware: {out_path} (changes: {total_changes})", file=out)
+                result.out_path = out_path
+                if summary_lines:
+                    print("Summary:", file=out)
+                    for line in summary_lines:
+                        print("  " + line, file=out)
+            except Exception as e:
+                print(f"Error writing output for {cfg.profile}: {e}", file=err)
+
+    result.stdout = out.getvalue()
+    result.stderr = err.getvalue()
+    return result
+
+
 def main() -> int:
     ap = argparse.ArgumentParser(
         description="Generic DTB patcher driven by INI config (LED gpios, etc.)"
@@ -612,30 +974,46 @@ def main() -> int:
     args = ap.parse_args()
 
     with open(args.firmware, "rb") as f:
-        original_data = bytearray(f.read())
+        original_data = map_firmware(f)
+    try:
+        return run(args, original_data)
+    finally:
+        if isinstance(original_data, mmap.mmap):
+            original_data.close()
 
-    dtbs = scan_dtbs(original_data)
-    if not dtbs:
-        print("No DTB found", file=sys.stderr)
-        return 1
 
-    # 列表模式: 打印 DTB 和 /leds 节点信息
-    led_presence = []  # list[(idx, has_green)]
-    for i, (off, hdr) in enumerate(dtbs):
-        props = parse_properties(original_data, off, hdr)
-        has_green = any(p.node_path.endswith("/green") for p in props)
-        led_presence.append((i, has_green))
-        if args.list:
+def run(args: argparse.Namespace, original_data: Union[mmap.mmap, bytes]) -> int:
+    """扫描固件并按配置为各机型生成补丁固件，返回进程退出码。"""
+    # 列表模式: 边扫描边打印 DTB 和 /leds 节点信息，不必等全部 DTB 找完
+    if args.list:
+        found = 0
+        for i, (off, hdr) in enumerate(iter_dtbs(original_data)):
+            found += 1
+            props = parse_dtb(original_data, off, hdr)
+            # 先在 C 层按节点去重，前缀判断只对每个节点做一次
             led_nodes = sorted(
-                set(p.node_path for p in props if p.node_path.startswith("/leds"))
+                path for path in dict.fromkeys(props.node_paths) if path.startswith("/leds")
             )
             print(
                 f"[DTB {i}] offset=0x{off:X} total={hdr.totalsize} "
                 f"LED nodes: {', '.join(led_nodes) if led_nodes else '-'}"
             )
-    if args.list:
+        if not found:
+            print("No DTB found", file=sys.stderr)
+            return 1
         return 0
 
+    dtbs = scan_dtbs(original_data)
+    if not dtbs:
+        print("No DTB found", file=sys.stderr)
+        return 1
+
+    # 每个 DTB 只解析一次，结果供所有 profiles 复用；外层 FIT 也只检测一次
+    # (补丁只原地改写属性值，不影响属性偏移与节点结构)
+    dtb_props = [parse_dtb(original_data, off, hdr) for off, hdr in dtbs]
+    dtb_node_sets = [set(props.node_paths) for props in dtb_props]
+    fit = None if args.no_fit_hash else detect_fit(dtbs, original_data, dtb_props)
+
     # 始终按 INI 解析；若未指定 --config，则默认使用 leds.ini
     try:
         configs = load_ini_config(args.config, getattr(args, "profile", None))
@@ -661,53 +1039,36 @@ def main() -> int:
         )
         return 1
 
-    # 处理所有 profiles
+    # 各 profile 相互独立 (共享只读原始数据，各自记录修改)，并行处理；
+    # 日志先写入各自缓冲区，完成后按配置顺序回放
+    workers = min(len(configs), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        results = list(
+            ex.map(
+                lambda cfg: patch_board(
+                    cfg, original_data, dtbs, dtb_props, dtb_node_sets, fit, args
+                ),
+                configs,
+            )
+        )
+
     all_success = True
     generated_files = []
     skipped_boards = []  # Track boards that were skipped due to no changes
-    
-    for cfg in configs:
-        print(f"\n{'='*60}")
-        print(f"Processing board: {cfg.profile}")
-        print(f"{'='*60}")
-        
-        # 为每个 profile 创建独立的数据副本
-        data = bytearray(original_data)
-        
-        total_changes, summary_lines = process_single_profile(cfg, data, dtbs, args)
-        
-        if total_changes == 0:
-            print(f"No changes applied for {cfg.profile} (all values already set to target values or properties not found)")
-            skipped_boards.append(cfg.profile)
+
+    for res in results:
+        sys.stdout.write(res.stdout)
+        if res.stderr:
+            sys.stdout.flush()
+            sys.stderr.write(res.stderr)
+        if res.skipped:
+            skipped_boards.append(res.profile)
             # 如果只处理一个 profile，则返回错误码
             if len(configs) == 1:
                 return 2
-            # 如果处理多个 profiles，继续处理下一个
-            continue
-
-        # 输出文件名
-        if args.output:
-            out_path = args.output
+        elif res.out_path:
+            generated_files.append(res.out_path)
         else:
-            base_name = os.path.basename(args.firmware)
-            out_path = f"{cfg.profile}-{base_name}"
-
-        if os.path.abspath(out_path) == os.path.abspath(args.firmware):
-            print(f"Error: Refusing to overwrite input for {cfg.profile} (choose different -o)", file=sys.stderr)
-            all_success = False
-            continue
-
-        try:
-            with open(out_path, "wb") as f:
-                f.write(data)
-            print(f"Wrote patched firmware: {out_path} (changes: {total_changes})")
-            generated_files.append(out_path)
-            if summary_lines:
-                print("Summary:")
-                for line in summary_lines:
-                    print("  " + line)
-        except Exception as e:
-            print(f"Error writing output for {cfg.profile}: {e}", file=sys.stderr)
             all_success = False
 
     # 最终总结